@@ -1,3 +1,11 @@
+import os
+import sys
+from bisect import bisect_left
+from packedkeys import PackedKeys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # shared profiler.py lives in the repository root
+from profiler import span
+
+
 class BPlusTreeNode:
     def __init__(self, order, is_leaf=False, parent=None):
         self.order = order
@@ -11,9 +19,7 @@ class BPlusTreeNode:
         return len(self.keys) > self.order - 1  # max keys = order - 1
 
     def insert_key_sorted(self, key): # inserts key in sorted order and returns the key's index
-        idx = 0
-        while idx < len(self.keys) and key > self.keys[idx]:
-            idx += 1
+        idx = bisect_left(self.keys, key)   # first key >= the new one
         self.keys.insert(idx, key)
         return idx
 
@@ -27,30 +33,64 @@ class BPlusTreeNode:
 
 
 class BPlusTree:
-    # constructor
-    def __init__(self, order):
+    # constructor, profiler is an optional profiler.Profiler that gets per-operation timings and counters.
+    # compressed_leaves stores leaf keys as PackedKeys (integer keys only), and leaf_order sets how many
+    # keys a leaf can hold (defaults to order) so compressed leaves can be made bigger than internal nodes
+    def __init__(self, order, profiler=None, compressed_leaves=False, leaf_order=None):
         self.order = order
-        self.root = BPlusTreeNode(order, is_leaf=True)
+        self.leaf_order = leaf_order or order
+        self.compressed_leaves = compressed_leaves
+        self.profiler = profiler
+        self._leaf_buf = []   # reused to decode compressed leaves during range scans
+        self.root = self._new_leaf()
+
+    # make an empty leaf in this tree's leaf format
+    def _new_leaf(self, parent=None):
+        leaf = BPlusTreeNode(self.leaf_order, is_leaf=True, parent=parent)
+        if self.compressed_leaves:
+            leaf.keys = PackedKeys()
+        return leaf
+
+    # keys of a leaf from index start on as a list, compressed leaves are decoded into the shared buffer
+    def _leaf_keys(self, leaf, start=0):
+        if self.compressed_leaves:
+            return leaf.keys.decode(self._leaf_buf, start)
+        return leaf.keys[start:] if start else leaf.keys
+
+    # index of the first key >= key in a leaf
+    def _leaf_bisect(self, leaf, key):
+        if self.compressed_leaves:
+            return leaf.keys.bisect_left(key)
+        return bisect_left(leaf.keys, key)
 
     # Tracks nodes accessed/modified during operations, used because the project requires we do that
     def _record(self, tracer, *nodes):
         if tracer is not None:
             tracer.extend(nodes)
 
+    # Counts an event (node visit, split, merge...) on the profiler, if there is one
+    def _count(self, name, n=1):
+        if self.profiler is not None:
+            self.profiler.count(name, n)
+
     # walk down to correct leaf
     def _find_leaf(self, key):
         node = self.root
+        visits = 1
         while not node.is_leaf:
             i = 0
             while i < len(node.keys) and key >= node.keys[i]:
                 i += 1
             node = node.children[i]
+            visits += 1
+        self._count("node_visits", visits)
         return node
 
     # Split a full leaf node into two and return the new right node + key
     def _split_leaf(self, leaf):
-        mid = (self.order) // 2
-        new_leaf = BPlusTreeNode(self.order, is_leaf=True, parent=leaf.parent)
+        self._count("leaf_splits")
+        mid = (leaf.order) // 2
+        new_leaf = self._new_leaf(parent=leaf.parent)
 
         # Distribute keys across the two leaf nodes
         new_leaf.keys = leaf.keys[mid:]
@@ -66,6 +106,7 @@ class BPlusTree:
 
     # internal split: make new internal node, retur (new_right, key to promote)
     def _split_internal(self, internal):
+        self._count("internal_splits")
         mid_idx = len(internal.keys) // 2
         promoted_key = internal.keys[mid_idx]
 
@@ -86,21 +127,22 @@ class BPlusTree:
 
     
     def insert(self, key, tracer=None):
-        # Insert key into correct leaf
-        leaf_path = []  # to collect nodes before split
-        leaf = self._find_leaf(key)
-        self._record(tracer, leaf)
-        before = str(leaf)
-        leaf.insert_key_sorted(key)
-
-        # if the leaf overflows, split it and send the promoted key up
-        if leaf.is_full():
-            new_leaf, promo = self._split_leaf(leaf)
-            self._record(tracer, new_leaf)  # new node created
-            self._propagate_split(leaf, new_leaf, promo, tracer)
-
-        if tracer is not None and before != str(leaf):
-            tracer.append(("UPDATED", before, str(leaf)))
+        with span(self.profiler, "bplustree.insert"):
+            # Insert key into correct leaf
+            leaf_path = []  # to collect nodes before split
+            leaf = self._find_leaf(key)
+            self._record(tracer, leaf)
+            before = str(leaf)
+            leaf.insert_key_sorted(key)
+
+            # if the leaf overflows, split it and send the promoted key up
+            if leaf.is_full():
+                new_leaf, promo = self._split_leaf(leaf)
+                self._record(tracer, new_leaf)  # new node created
+                self._propagate_split(leaf, new_leaf, promo, tracer)
+
+            if tracer is not None and before != str(leaf):
+                tracer.append(("UPDATED", before, str(leaf)))
  
     # handle split propogation up a tree, create a new root if necessary
     def _propagate_split(self, left, right, promo_key, tracer=None):
@@ -113,6 +155,7 @@ class BPlusTree:
             new_root.children = [left, right]
             left.parent = right.parent = new_root
             self.root = new_root
+            self._count("root_splits")
             self._record(tracer, new_root)
             return
 
@@ -138,35 +181,42 @@ class BPlusTree:
     
     # search for a key by walking to the correct leaf and checking
     def search(self, key, tracer=None):
-        node = self.root
-        while True:
-            self._record(tracer, node) # track nodes touched
-            if node.is_leaf:
-                return key in node.keys
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
-            node = node.children[i]
+        with span(self.profiler, "bplustree.search"):
+            node = self.root
+            visits = 1
+            while True:
+                self._record(tracer, node) # track nodes touched
+                if node.is_leaf:
+                    self._count("node_visits", visits)
+                    return key in node.keys
+                i = 0
+                while i < len(node.keys) and key >= node.keys[i]:
+                    i += 1
+                node = node.children[i]
+                visits += 1
 
     #return all keys in [start key, end key] by scanning the leaf nodes
     def range_search(self, start_key, end_key):
-        result = []
-        leaf = self._find_leaf(start_key)
-
-        while leaf is not None:
-            for k in leaf.keys:
-                if start_key <= k <= end_key:
+        with span(self.profiler, "bplustree.range_search"):
+            result = []
+            leaf = self._find_leaf(start_key)
+            start = self._leaf_bisect(leaf, start_key)  # skip the keys below the range in the first leaf
+
+            while leaf is not None:
+                self._count("leaf_visits")
+                for k in self._leaf_keys(leaf, start):
+                    if k > end_key:
+                        return result # early exit if keys exceed the range
                     result.append(k)
-                elif k > end_key:
-                    return result # early exit if keys exceed the range
-            leaf = leaf.next_leaf
-        return result
+                start = 0   # later leaves only hold keys above start_key
+                leaf = leaf.next_leaf
+            return result
 
 
 
      # returns smalllest amount of keys lalowed in non root node (used for underflow check)
-    def _min_keys(self):
-        return (self.order + 1) // 2 - 1          # ceil(order/2) − 1
+    def _min_keys(self, node):
+        return (node.order + 1) // 2 - 1          # ceil(order/2) − 1 (leaves use the leaf order)
 
     # Get left/right sibling of a node and its separator info (used in rebalacing)
     def _sibling(self, node, want_left=True):
@@ -187,6 +237,7 @@ class BPlusTree:
 
     # merge right into left and delete separator key from parent (used when borrowing fails)
     def _merge_nodes(self, left, right, sep_idx, tracer=None):
+        self._count("merges")
         parent = left.parent
         self._record(tracer, left, right, parent)
         before_left, before_parent = str(left), str(parent)
@@ -216,7 +267,7 @@ class BPlusTree:
         if parent is self.root and len(parent.keys) == 0:
             self.root = left
             self.root.parent = None
-        elif parent is not self.root and len(parent.keys) < self._min_keys():
+        elif parent is not self.root and len(parent.keys) < self._min_keys(parent):
             # parent underflow, recurse upward
             self._rebalance(parent, tracer)
 
@@ -232,39 +283,40 @@ class BPlusTree:
 
     
     def delete(self, key, tracer=None):
-        leaf = self._find_leaf(key)
-        self._record(tracer, leaf)
-
-        if key not in leaf.keys: # key isn't present in the tree to begin with
-            return False
-
-        before_leaf = str(leaf)
-        leaf.keys.remove(key)
-
-        # log update for tracing
-        if tracer is not None and before_leaf != str(leaf):
-            tracer.append(("UPDATED", before_leaf, str(leaf)))
-
-        # Tree has only one node (root)
-        if leaf is self.root:
-            if len(self.root.keys) == 0 and not self.root.is_leaf:
-                self.root = self.root.children[0]
-                self.root.parent = None
-            return True
-
-        # leaf has enough keys to stay valid
-        if len(leaf.keys) >= self._min_keys():
-            if leaf.keys:
-                self._refresh_parent_key(leaf) # maintain parent key correctness
+        with span(self.profiler, "bplustree.delete"):
+            leaf = self._find_leaf(key)
+            self._record(tracer, leaf)
+
+            if key not in leaf.keys: # key isn't present in the tree to begin with
+                return False
+
+            before_leaf = str(leaf)
+            leaf.keys.remove(key)
+
+            # log update for tracing
+            if tracer is not None and before_leaf != str(leaf):
+                tracer.append(("UPDATED", before_leaf, str(leaf)))
+
+            # Tree has only one node (root)
+            if leaf is self.root:
+                if len(self.root.keys) == 0 and not self.root.is_leaf:
+                    self.root = self.root.children[0]
+                    self.root.parent = None
+                return True
+
+            # leaf has enough keys to stay valid
+            if len(leaf.keys) >= self._min_keys(leaf):
+                if leaf.keys:
+                    self._refresh_parent_key(leaf) # maintain parent key correctness
+                return True
+
+            # Leaf underflows, needs rebalancing
+            self._rebalance(leaf, tracer)
             return True
 
-        # Leaf underflows, needs rebalancing
-        self._rebalance(leaf, tracer)
-        return True
-
     # Rebalances tree after node drops below minimum key count, tries to borrow from siblings and merges if needed
     def _rebalance(self, node, tracer=None):
-        min_k = self._min_keys()
+        min_k = self._min_keys(node)
 
          # If the node has been merged out during an earlier step, stop
         if node.parent is None:
@@ -277,6 +329,7 @@ class BPlusTree:
         # Try borrowing key from left sibling
         left, _, sep_idx = self._sibling(node, want_left=True)
         if left and len(left.keys) > min_k:
+            self._count("borrows")
             self._record(tracer, left, node, node.parent)
             before_left, before_node = str(left), str(node)
 
@@ -299,6 +352,7 @@ class BPlusTree:
         # Try borrowing from right sibling
         right, _, sep_right = self._sibling(node, want_left=False)
         if right and len(right.keys) > min_k:
+            self._count("borrows")
             self._record(tracer, node, right, node.parent)
             before_right, before_node = str(right), str(node)
 
@@ -0,0 +1,89 @@
+# Compares list-based leaves with compressed (PackedKeys) leaves:
+# memory per key, tree shape, build time, point lookups and range scans
+import random
+import sys
+import time
+from bplustree import BPlusTree
+from generator import generate_records
+from profiler import Profiler
+
+NUM_KEYS = 50_000
+ORDER = 24
+LOOKUPS = 20_000
+RANGE_SCANS = 500
+RANGE_WIDTH = 2_000      # key values per range scan (about 1000 keys at this density)
+
+# (label, BPlusTree keyword arguments)
+CONFIGS = [
+    ("list leaves", {}),
+    ("packed leaves", {"compressed_leaves": True}),
+    ("packed leaves, 4x keys", {"compressed_leaves": True, "leaf_order": ORDER * 4}),
+    ("packed leaves, 8x keys", {"compressed_leaves": True, "leaf_order": ORDER * 8}),
+]
+
+def leaves(tree):
+    node = tree.root
+    while not node.is_leaf:
+        node = node.children[0]
+    while node is not None:
+        yield node
+        node = node.next_leaf
+
+def height(tree):
+    h, node = 1, tree.root
+    while not node.is_leaf:
+        h, node = h + 1, node.children[0]
+    return h
+
+# bytes held by the keys of a leaf: the list and its int objects, or the packed payload
+def leaf_key_bytes(leaf):
+    if isinstance(leaf.keys, list):
+        return sys.getsizeof(leaf.keys) + sum(sys.getsizeof(k) for k in leaf.keys)
+    return leaf.keys.nbytes()
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run(label, kwargs, keys, probes, ranges):
+    tree = BPlusTree(ORDER, **kwargs)
+    build_s = timed(lambda: [tree.insert(k) for k in keys])
+
+    all_leaves = list(leaves(tree))
+    bytes_per_key = sum(leaf_key_bytes(leaf) for leaf in all_leaves) / len(keys)
+    lookup_s = timed(lambda: [tree.search(k) for k in probes])
+    range_s = timed(lambda: [tree.range_search(lo, hi) for lo, hi in ranges])
+
+    # count the nodes the range scans touch (separate run, the profiler isn't free)
+    prof = Profiler()
+    tree.profiler = prof
+    results = [tree.range_search(lo, hi) for lo, hi in ranges]
+    leaf_visits = prof.counters["bplustree.range_search.leaf_visits"] / len(ranges)
+
+    print(f"{label:<24} {height(tree):>6} {len(all_leaves):>7} {bytes_per_key:>10.1f} {build_s:>8.3f}"
+          f" {LOOKUPS / lookup_s:>11.0f} {RANGE_SCANS / range_s:>10.0f} {leaf_visits:>11.1f}")
+    return results
+
+def main():
+    rng = random.Random(42)
+    random.seed(42)   # generate_records uses the global random module
+    keys = generate_records(num_records=NUM_KEYS)   # dense integer IDs in [100000, 200000]
+    rng.shuffle(keys)
+    probes = [rng.randint(100_000, 200_000) for _ in range(LOOKUPS)]   # about half hit
+    starts = [rng.randint(100_000, 200_000 - RANGE_WIDTH) for _ in range(RANGE_SCANS)]
+    ranges = [(lo, lo + RANGE_WIDTH) for lo in starts]
+
+    print(f"{NUM_KEYS} keys, order {ORDER}, {LOOKUPS} lookups, {RANGE_SCANS} range scans of width {RANGE_WIDTH}\n")
+    print(f"{'leaf format':<24} {'height':>6} {'leaves':>7} {'bytes/key':>10} {'build s':>8}"
+          f" {'lookups/s':>11} {'ranges/s':>10} {'leaves/scan':>11}")
+    expected = None
+    for label, kwargs in CONFIGS:
+        results = run(label, kwargs, keys, probes, ranges)
+        if expected is None:
+            expected = results
+        elif results != expected:
+            print(f"WARNING: {label} returned different range scan results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import sys
+from bisect import bisect_left
+
+# Scratch list shared by every PackedKeys for edits (decode -> change -> re-encode),
+# so inserting into a leaf doesn't allocate a new list each time
+_SCRATCH = []
+
+
+class PackedKeys:
+    """
+    Sorted integer keys of one leaf, stored frame-of-reference + bit-packed:
+    every key is saved as (key - base) in `width` bits, where base is the smallest key
+    and width is just enough bits for the largest offset. Ten dense keys spanning 100
+    values take 7 bits each instead of a list slot plus an int object (8 + 28 bytes).
+
+    Reading key i only unpacks those bits, so lookups and binary search never decode
+    the whole leaf. Edits decode into a shared scratch list and pack it again.
+    Supports the list operations BPlusTree uses on leaf keys.
+    """
+    __slots__ = ("base", "width", "n", "data")
+
+    def __init__(self, keys=()):
+        self._pack(list(keys))
+
+    def _pack(self, keys):
+        if not keys:
+            self.base, self.width, self.n, self.data = 0, 0, 0, b""
+            return
+        if not all(isinstance(k, int) for k in keys):
+            raise TypeError("PackedKeys only holds integer keys")
+        base = min(keys)
+        width = (max(keys) - base).bit_length()
+        acc = 0
+        shift = 0
+        for k in keys:
+            acc |= (k - base) << shift
+            shift += width
+        self.base, self.width, self.n = base, width, len(keys)
+        self.data = acc.to_bytes((shift + 7) // 8, "little")
+
+    # unpack the key in slot i (0 <= i < n) without touching the rest
+    def _get(self, i):
+        w = self.width
+        if w == 0:
+            return self.base
+        bit = i * w
+        start = bit >> 3
+        end = (bit + w + 7) >> 3
+        return self.base + ((int.from_bytes(self.data[start:end], "little") >> (bit & 7)) & ((1 << w) - 1))
+
+    def decode(self, out=None, start=0):
+        """Keys from slot start on (all of them by default) as a list.
+            Pass a list to reuse it as the buffer (it is cleared first)"""
+        if out is None:
+            out = []
+        else:
+            out.clear()
+        w, base = self.width, self.base
+        if w == 0:
+            out.extend([base] * (self.n - start))
+            return out
+        acc = int.from_bytes(self.data, "little") >> (start * w)
+        mask = (1 << w) - 1
+        for _ in range(self.n - start):
+            out.append(base + (acc & mask))
+            acc >>= w
+        return out
+
+    def bisect_left(self, key):
+        """Index of the first key >= key, found by binary search over the packed slots"""
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # edit through the scratch list, then pack the result
+    def _edit(self):
+        return self.decode(_SCRATCH)
+
+    def insert(self, idx, key):
+        keys = self._edit()
+        keys.insert(idx, key)
+        self._pack(keys)
+
+    def append(self, key):
+        self.insert(self.n, key)
+
+    def extend(self, keys):
+        buf = self._edit()
+        buf.extend(keys)
+        self._pack(buf)
+
+    def pop(self, idx=-1):
+        keys = self._edit()
+        key = keys.pop(idx)
+        self._pack(keys)
+        return key
+
+    def remove(self, key):
+        keys = self._edit()
+        keys.remove(key)
+        self._pack(keys)
+
+    def index(self, key):
+        i = self.bisect_left(key)
+        if i < self.n and self._get(i) == key:
+            return i
+        raise ValueError(f"{key} is not in leaf")
+
+    def __contains__(self, key):
+        i = self.bisect_left(key)
+        return i < self.n and self._get(i) == key
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return PackedKeys(self.decode()[idx])
+        if idx < 0:
+            idx += self.n
+        if not 0 <= idx < self.n:
+            raise IndexError("PackedKeys index out of range")
+        return self._get(idx)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return iter(self.decode())
+
+    def nbytes(self):
+        """Memory used by this leaf's keys (object + packed payload)"""
+        return sys.getsizeof(self) + sys.getsizeof(self.data)
+
+    # print like a list so trees look the same with or without compression
+    def __repr__(self):
+        return repr(self.decode())
@@ -0,0 +1,117 @@
+import random
+from bisect import bisect_left
+from bplustree import BPlusTree
+from packedkeys import PackedKeys
+from profiler import Profiler
+
+# Checks compressed (PackedKeys) leaves against list leaves. Prints "ok" per test, an assert fails otherwise
+
+# every node's keys level by level, so two trees can be compared shape and all
+def tree_shape(tree):
+    shape, level = [], [tree.root]
+    while level:
+        shape.append([list(node.keys) for node in level])
+        level = [child for node in level if not node.is_leaf for child in node.children]
+    return shape
+
+# keys in leaf order, following the next_leaf links
+def leaf_chain(tree):
+    node = tree.root
+    while not node.is_leaf:
+        node = node.children[0]
+    keys = []
+    while node is not None:
+        keys.extend(node.keys)
+        node = node.next_leaf
+    return keys
+
+
+# PackedKeys encoding test: random key sets of every width, compared with the same list
+print("PackedKeys encoding:")
+rng = random.Random(608)
+for trial in range(2_000):
+    span = rng.choice([1, 2, 7, 8, 9, 255, 256, 1 << 16, 1 << 40, 1 << 70])  # widths across byte edges
+    base = rng.randint(-(1 << 20), 1 << 20)
+    keys = sorted(rng.randint(base, base + span - 1) for _ in range(rng.randint(0, 40)))
+    packed = PackedKeys(keys)
+
+    assert len(packed) == len(keys) and list(packed) == keys and packed.decode() == keys
+    assert [packed[i] for i in range(len(keys))] == keys
+    if keys:
+        assert packed[-1] == keys[-1]
+    start = rng.randint(0, len(keys))
+    assert packed.decode([123], start) == keys[start:]        # reused buffer is cleared first
+    assert list(packed[start:]) == keys[start:]
+    for probe in [base - 1, base + span] + [rng.randint(base, base + span) for _ in range(5)]:
+        assert packed.bisect_left(probe) == bisect_left(keys, probe)
+        assert (probe in packed) == (probe in keys)
+
+    # edits go through the scratch list and get packed again
+    expected = list(keys)
+    for _ in range(5):
+        op = rng.choice(["insert", "append", "extend", "pop", "remove"])
+        if op == "insert":
+            k = rng.randint(base - span, base + 2 * span)
+            idx = bisect_left(expected, k)
+            packed.insert(idx, k)
+            expected.insert(idx, k)
+        elif op == "append":
+            k = (expected[-1] if expected else base) + rng.randint(0, span)
+            packed.append(k)
+            expected.append(k)
+        elif op == "extend":
+            more = sorted(rng.randint(0, span) for _ in range(3))
+            more = [(expected[-1] if expected else base) + m for m in more]
+            packed.extend(more)
+            expected.extend(more)
+        elif expected and op == "pop":
+            idx = rng.randrange(-len(expected), len(expected))
+            assert packed.pop(idx) == expected.pop(idx)
+        elif expected:
+            k = rng.choice(expected)
+            packed.remove(k)
+            expected.remove(k)
+            if expected:
+                assert packed.index(expected[0]) == 0
+        assert list(packed) == expected
+print("ok")
+
+
+# Tree test: random inserts, deletes, searches and range scans on a list-leaf tree and a
+# compressed-leaf tree of the same orders; both must answer the same and keep the same shape
+print("Compressed leaves vs list leaves:")
+prof = Profiler()
+for order, leaf_order in [(3, None), (4, None), (5, None), (4, 9), (6, 24), (3, 7)]:
+    for trial in range(30):
+        plain = BPlusTree(order, leaf_order=leaf_order)
+        packed = BPlusTree(order, profiler=prof, compressed_leaves=True, leaf_order=leaf_order)
+        present = set()
+        low, high = rng.choice([(0, 300), (-150, 150), (100_000, 100_600), (0, 1 << 40)])
+        for step in range(400):
+            if present and rng.random() < 0.45:
+                k = rng.choice(sorted(present))   # delete: forces borrows and merges
+                plain.delete(k)
+                packed.delete(k)
+                present.discard(k)
+            else:
+                k = rng.randint(low, high)
+                if k not in present:               # insert: forces leaf and internal splits
+                    plain.insert(k)
+                    packed.insert(k)
+                    present.add(k)
+            if step % 20 == 0:
+                probe = rng.randint(low, high)
+                assert plain.search(probe) == packed.search(probe) == (probe in present)
+                lo = rng.randint(low, high)
+                hi = lo + rng.randint(-5, (high - low) // 4)
+                expected = sorted(k for k in present if lo <= k <= hi)
+                assert plain.range_search(lo, hi) == packed.range_search(lo, hi) == expected
+        assert leaf_chain(packed) == leaf_chain(plain) == sorted(present)
+        assert tree_shape(packed) == tree_shape(plain)
+    print(f"order {order}, leaf_order {leaf_order or order}: ok")
+
+# every split/borrow/merge path of the compressed tree was taken at least once
+for event in ("leaf_splits", "internal_splits", "root_splits", "borrows", "merges"):
+    count = sum(v for name, v in prof.counters.items() if name.endswith(event))
+    print(f"{event}: {count}")
+    assert count > 0
@@ -0,0 +1,208 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from disk import Block, VirtualDisk, VirtualMemory
+from join import append_tuple, h
+from profiler import Profiler, span
+
+# How a fresh value starts a group and how two partial results for the same group combine.
+# Partials combine with the same function no matter how many tuples they cover, which is what
+# lets us pre-aggregate before spilling and finish the job in pass 2.
+AGGREGATES = {
+    "COUNT": (lambda v: 1, lambda x, y: x + y),
+    "SUM":   (lambda v: v, lambda x, y: x + y),
+    "MIN":   (lambda v: v, min),
+    "MAX":   (lambda v: v, max),
+}
+
+def _lookup(agg: str):
+    try:
+        return AGGREGATES[agg.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown aggregate {agg!r}, expected one of {sorted(AGGREGATES)}")
+
+# number of groups that fit in the given number of memory blocks (one (group, value) pair per slot)
+def _groups_in(blocks: int) -> int:
+    return blocks * Block.MAX_TUPLES
+
+class _GroupTable(dict):
+    """group -> partial result. Its memory is reserved on vm one block (Block.MAX_TUPLES groups)
+        at a time, so it counts against the memory limit like any buffered block"""
+    def __init__(self, vm: VirtualMemory, max_blocks: int):
+        super().__init__()
+        self.vm = vm
+        self.max_blocks = max_blocks
+        self.blocks = 0
+
+    def try_add(self, g, partial) -> bool:
+        """Adds a new group, reserving another block when the current ones are full.
+            Returns False if the table is at max_blocks or memory has no free slot left"""
+        if len(self) >= _groups_in(self.blocks):
+            if self.blocks >= self.max_blocks or self.vm.free_slots() <= 0:
+                return False
+            self.vm.reserve(1)
+            self.blocks += 1
+        self[g] = partial
+        return True
+
+    def shrink(self, blocks: int) -> List[Tuple[int, int]]:
+        """Keeps the groups of the first `blocks` blocks (in insertion order), gives the other
+            blocks back to vm and returns the (group, partial) pairs that were dropped"""
+        keep = _groups_in(blocks)
+        evicted = list(self.items())[keep:]
+        for g, _ in evicted:
+            del self[g]
+        self.vm.release(self.blocks - blocks)
+        self.blocks = blocks
+        return evicted
+
+    def release(self):
+        self.clear()
+        self.vm.release(self.blocks)
+        self.blocks = 0
+
+def _spill(vm: VirtualMemory, parts: List[VirtualDisk], open_slots: List[Dict], merge,
+           g: int, partial, pre_aggregate: bool, level: int):
+    """Sends one (group, partial) pair to its partition. With pre_aggregate, a group that is
+        already in the partition's output buffer is combined in place instead of taking a new slot"""
+    pid = h(g, len(parts), level)   # a new hash on every repartitioning level
+    slots = open_slots[pid]
+    if pre_aggregate and g in slots:
+        blk = parts[pid].blocks[-1]
+        blk.records[slots[g]] = (g, merge(blk.records[slots[g]][1], partial))
+        return
+    blocks_before = len(parts[pid])
+    append_tuple(vm, parts[pid], (g, partial))
+    if len(parts[pid]) != blocks_before:
+        slots.clear()  # a new output buffer was started, forget the old one
+    slots[g] = len(parts[pid].blocks[-1]) - 1
+
+MAX_LEVELS = 8  # times a partition gets split again before we give up on it
+RESIDENT_SHARE = 4  # with pre_aggregate, 1/RESIDENT_SHARE of a full group table stays in memory
+
+def _aggregate_pairs(pairs: Iterator[tuple], merge, vm: VirtualMemory, mem_blocks: int,
+                     pre_aggregate: bool, prefetch: int, level: int = 0) -> List[Tuple[int, int]]:
+    """Combines (group, partial) pairs per group, in memory if the groups fit and with hash partitions
+        otherwise. A partition that still has too many groups is split again one level deeper"""
+    # Try to aggregate everything in memory
+    table = _GroupTable(vm, mem_blocks - 1)  # Leave one block for input buffering
+    num_partitions = 0   # output buffers held in memory while partitioning
+    try:
+        for g, partial in pairs:
+            if g in table:
+                table[g] = merge(table[g], partial)
+            elif not table.try_add(g, partial):
+                break
+        else:
+            return list(table.items())  # everything fit, no spilling needed
+        if table.blocks < 2:
+            # one partition would just be the same input again, splitting needs two output buffers
+            raise RuntimeError("Main memory full, need at least 2 blocks to partition the groups")
+        if level >= MAX_LEVELS:
+            raise RuntimeError("Partition still too large after repartitioning")
+
+        # The group table overflowed. Its memory becomes partition output buffers, except that with
+        # pre_aggregate the groups of its first blocks stay resident (hybrid hash): they keep
+        # aggregating in memory and never touch the disk, only the other groups are spilled
+        resident = min(table.blocks // RESIDENT_SHARE, table.blocks - 2) if pre_aggregate else 0
+        num_partitions = table.blocks - resident
+        overflow = table.shrink(resident)
+        vm.reserve(num_partitions)
+
+        prefix = "agg_part" if level == 0 else f"agg_part{level}."
+        parts = [VirtualDisk(f"{prefix}{pid}") for pid in range(num_partitions)]
+        open_slots = [{} for _ in range(num_partitions)]  # group -> slot in each partition's output buffer
+        for pg, pp in overflow:
+            _spill(vm, parts, open_slots, merge, pg, pp, pre_aggregate, level)
+        _spill(vm, parts, open_slots, merge, g, partial, pre_aggregate, level)  # the pair that didn't fit
+        for g, partial in pairs:
+            if g in table:
+                table[g] = merge(table[g], partial)
+            else:
+                _spill(vm, parts, open_slots, merge, g, partial, pre_aggregate, level)
+        result = list(table.items())  # resident groups are complete
+    finally:
+        table.release()
+        vm.release(num_partitions)
+
+    # Pass 2: finish each partition, in memory if it fits
+    if level == 0:
+        vm.enter_phase("merge")
+    for part in parts:
+        if len(part) > 0:
+            # read ahead only if it can't crowd out the table (a partition never has more groups than pairs)
+            depth = prefetch if len(part) + prefetch < min(mem_blocks, vm.free_slots()) else 0
+            result.extend(_aggregate_pairs(_scan(part, vm, depth), merge, vm, mem_blocks,
+                                           pre_aggregate, prefetch, level + 1))
+    return result
+
+def hash_aggregate_stream(tuples: Iterable[tuple], group_col: int, agg_col: int, agg: str,
+                          vm: VirtualMemory, mem_blocks: Optional[int] = None,
+                          pre_aggregate: bool = True, prefetch: int = 0) -> List[Tuple[int, int]]:
+    """
+    Groups a stream of tuples on tup[group_col] and aggregates tup[agg_col] with COUNT, SUM, MIN or MAX.
+    The stream can come from a scan or straight out of a *_hash_join_stream, so a join result
+    never has to be written out before it's aggregated. Disk IOs are counted on vm.
+
+    The group table is reserved on vm, so it shares the memory limit with whatever else is using
+    vm, e.g. the join feeding it (which sizes its hash tables to the memory left over). By default
+    the aggregate takes at most half of the memory, pass mem_blocks to change that.
+    Groups are kept in memory until they outgrow mem_blocks - 1 blocks or the free memory. If that
+    never happens the answer comes straight from memory with no extra IOs. Otherwise the partial
+    results are spilled to hash partitions (same as the join's pass 1), the rest of the input
+    follows them, and each partition is finished in pass 2 (split again if it still doesn't fit).
+    With pre_aggregate, the groups already in the first quarter of the table stay in memory and
+    keep aggregating (usually the frequent ones, they show up first), and a spilled tuple whose
+    group is already sitting in the partition's output buffer is combined there, so fewer blocks
+    get written.
+    prefetch = N reads N blocks ahead while scanning the partitions in pass 2 (when there is room).
+    Returns a list of (group, value) pairs.
+    """
+    with span(vm.profiler, "hash_aggregate"):
+        vm.enter_phase("aggregate")   # the input scan (if it's ours), the in-memory table and any spilled partial results
+        init, merge = _lookup(agg)
+        if mem_blocks is None:
+            mem_blocks = VirtualMemory.MAX_BLOCKS // 2   # leave the rest to the operator feeding us
+        pairs = ((tup[group_col], init(tup[agg_col])) for tup in vm.pull(tuples))
+        return _aggregate_pairs(pairs, merge, vm, mem_blocks, pre_aggregate, prefetch)
+
+def _scan(disk: VirtualDisk, vm: VirtualMemory, prefetch: int = 0):
+    # read one block at a time and hand its tuples (or spilled pairs) to the aggregator
+    for blk in vm.scan(disk, prefetch):
+        yield from blk
+
+def one_pass_hash_aggregate(disk: VirtualDisk, group_col: int, agg_col: int, agg: str = "COUNT",
+                            mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                            prefetch: int = 0,
+                            profiler: Optional[Profiler] = None) -> Tuple[List[Tuple[int, int]], int]:
+    """Groups the relation on group_col and aggregates agg_col in a single scan.
+        Assumes every group fits in memory at once (mem_blocks - 1 blocks of (group, value) pairs,
+        minus any read-ahead slots)
+        Returns (list of (group, value), number of disk IOs)"""
+    init, merge = _lookup(agg)
+    vm = VirtualMemory(profiler)
+
+    with span(profiler, "one_pass_hash_aggregate"):
+        vm.enter_phase("aggregate")
+        table = _GroupTable(vm, mem_blocks - 1)  # Leave one block for input buffering
+        for tup in _scan(disk, vm, prefetch):
+            g, v = tup[group_col], tup[agg_col]
+            if g in table:
+                table[g] = merge(table[g], init(v))
+            elif not table.try_add(g, init(v)):
+                raise RuntimeError("Group table too large for one-pass")
+        result = list(table.items())
+        table.release()
+    return result, vm.io_counter
+
+def two_pass_hash_aggregate(disk: VirtualDisk, group_col: int, agg_col: int, agg: str = "COUNT",
+                            mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                            pre_aggregate: bool = True, prefetch: int = 0,
+                            profiler: Optional[Profiler] = None) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Groups the relation on group_col and aggregates agg_col, spilling hash partitions
+    to disk when the groups don't fit in memory. See hash_aggregate_stream.
+    Returns (list of (group, value), total disk IOs)
+    """
+    vm = VirtualMemory(profiler)
+    result = hash_aggregate_stream(_scan(disk, vm, prefetch), group_col, agg_col, agg, vm,
+                                   mem_blocks, pre_aggregate, prefetch)
+    return result, vm.io_counter
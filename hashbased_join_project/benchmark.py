@@ -0,0 +1,169 @@
+# Repeatable benchmark for the hash join algorithms.
+# Sweeps relation size, memory size, block size, key skew and algorithm, and records
+# wall-clock time, throughput, peak memory and per-phase disk I/Os to JSON and/or CSV.
+# Every run is checked against a reference join, so optimizations can be compared safely.
+# peak_mem_blocks is VirtualMemory.peak_blocks: input and build blocks plus everything reserved
+# (partition output buffers, read-ahead slots), so it can never go over the memory size.
+#
+#   python benchmark.py                                   # default sweep, table on stdout
+#   python benchmark.py --sizes 1000 --mem-blocks 10,15,30 --csv results.csv
+import argparse
+import csv
+import json
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from itertools import product
+
+import data_gen
+from data_gen import build_relation_S, build_relation_R
+from disk import Block, VirtualMemory
+from join import (R_SCHEMA, S_SCHEMA, one_pass_join_stream, two_pass_join_stream,
+                  pipelined_hash_join_stream)
+
+# Every algorithm yields R(A, B) join S(B, C) as (A, B, C) tuples, counting IOs on vm
+ALGORITHMS = {
+    "one_pass": lambda R, S, vm: one_pass_join_stream(R, S, R_SCHEMA, S_SCHEMA, (1,), (0,), vm),
+    "two_pass": lambda R, S, vm: two_pass_join_stream(R, S, R_SCHEMA, S_SCHEMA, (1,), (0,), vm,
+                                                      VirtualMemory.MAX_BLOCKS),
+    "two_pass_prefetch": lambda R, S, vm: two_pass_join_stream(R, S, R_SCHEMA, S_SCHEMA, (1,), (0,), vm,
+                                                               VirtualMemory.MAX_BLOCKS, prefetch=2),
+    # R stays resident as the build table, S streams through it; output is (B, C, A)
+    "pipelined": lambda R, S, vm: ((a, b, c) for (b, c, a) in
+                                   pipelined_hash_join_stream(S, S_SCHEMA, [(R, R_SCHEMA, (0,), (1,))], vm)),
+}
+
+PHASES = ("partition.read", "partition.write", "build.read", "probe.read")
+
+# Join computed straight from the blocks, without the memory model, to check results against
+def reference_join(R, S):
+    by_b = defaultdict(list)
+    for blk in S.blocks:
+        for b, c in blk:
+            by_b[b].append(c)
+    return Counter((a, b, c) for blk in R.blocks for a, b in blk for c in by_b.get(b, ()))
+
+def run_algorithm(name, R, S, expected, repeat, measure_heap):
+    """Runs one algorithm `repeat` times and returns its metrics (timing from the fastest run)"""
+    row = {"algorithm": name}
+    times = []
+    try:
+        for _ in range(repeat):
+            vm = VirtualMemory()
+            start = time.perf_counter()
+            out = list(ALGORITHMS[name](R, S, vm))
+            times.append(time.perf_counter() - start)
+
+        heap_peak = None
+        if measure_heap:
+            # separate run, tracemalloc slows everything down too much to time it
+            tracemalloc.start()
+            list(ALGORITHMS[name](R, S, VirtualMemory()))
+            heap_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    except RuntimeError as e:   # doesn't fit in memory with this configuration
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        row["status"] = f"error: {e}"
+        return row
+
+    best = min(times)
+    input_tuples = sum(len(blk) for blk in R.blocks) + sum(len(blk) for blk in S.blocks)
+    row.update({
+        "status": "ok",
+        "correct": Counter(out) == expected,
+        "output_tuples": len(out),
+        "wall_s": round(best, 6),
+        "wall_s_mean": round(sum(times) / len(times), 6),
+        "tuples_per_s": round(input_tuples / best) if best > 0 else None,
+        "total_io": vm.io_counter,
+        "peak_mem_blocks": vm.peak_blocks,
+        "peak_heap_bytes": heap_peak,
+    })
+    for phase in PHASES:
+        row[f"io_{phase.replace('.', '_')}"] = vm.phase_io.get(phase, 0)
+    return row
+
+def sweep(sizes, s_size, mem_blocks, tuples_per_block, skews, algorithms, repeat, seed, measure_heap):
+    rows = []
+    saved = (VirtualMemory.MAX_BLOCKS, Block.MAX_TUPLES)
+    try:
+        for r_size, m, t, skew in product(sizes, mem_blocks, tuples_per_block, skews):
+            VirtualMemory.MAX_BLOCKS, Block.MAX_TUPLES = m, t
+            data_gen.rng.seed(seed)   # same relations for every algorithm of a configuration
+            S = build_relation_S(s_size)
+            R = build_relation_R(r_size, S, True, skew=skew)
+            expected = reference_join(R, S)
+            config = {"r_tuples": r_size, "s_tuples": s_size, "r_blocks": len(R), "s_blocks": len(S),
+                      "mem_blocks": m, "tuples_per_block": t, "skew": skew}
+
+            for name in algorithms:
+                row = dict(config)
+                row.update(run_algorithm(name, R, S, expected, repeat, measure_heap))
+                rows.append(row)
+                if row["status"] == "ok" and not row["correct"]:
+                    print(f"WARNING: {name} returned a wrong result for {config}")
+                if row["status"] == "ok" and row["peak_mem_blocks"] > m:
+                    print(f"WARNING: {name} used {row['peak_mem_blocks']} of {m} memory blocks for {config}")
+    finally:
+        VirtualMemory.MAX_BLOCKS, Block.MAX_TUPLES = saved
+    return rows
+
+def write_csv(rows, path):
+    fields = []
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_table(rows):
+    print(f"{'R':>6} {'M':>3} {'T':>3} {'skew':>4}  {'algorithm':<18} {'time(s)':>8} {'tuples/s':>9} "
+          f"{'IOs':>6} {'part r/w':>11} {'build':>6} {'probe':>6} {'peak':>4}  ok")
+    for r in rows:
+        head = f"{r['r_tuples']:>6} {r['mem_blocks']:>3} {r['tuples_per_block']:>3} {r['skew']:>4}  {r['algorithm']:<18}"
+        if r["status"] != "ok":
+            print(f"{head} {r['status']}")
+            continue
+        part = f"{r['io_partition_read']}/{r['io_partition_write']}"
+        print(f"{head} {r['wall_s']:>8.4f} {r['tuples_per_s']:>9} {r['total_io']:>6} {part:>11} "
+              f"{r['io_build_read']:>6} {r['io_probe_read']:>6} {r['peak_mem_blocks']:>4}  {r['correct']}")
+
+def _int_list(text):
+    return [int(x) for x in text.split(",")]
+
+def _float_list(text):
+    return [float(x) for x in text.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hash join algorithms")
+    parser.add_argument("--sizes", type=_int_list, default=[100, 1_000, 2_000], help="R sizes in tuples")
+    parser.add_argument("--s-size", type=int, default=5_000, help="S size in tuples")
+    parser.add_argument("--mem-blocks", type=_int_list, default=[15, 30], help="VirtualMemory.MAX_BLOCKS values")
+    parser.add_argument("--tuples-per-block", type=_int_list, default=[8, 16], help="Block.MAX_TUPLES values")
+    parser.add_argument("--skew", type=_float_list, default=[0.0, 1.0], help="Zipf skew of R's B values")
+    parser.add_argument("--algorithms", type=lambda s: s.split(","), default=list(ALGORITHMS),
+                        help="comma separated, any of " + ", ".join(ALGORITHMS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, fastest one is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-heap", action="store_true", help="skip the tracemalloc peak memory run")
+    parser.add_argument("--json", help="write results to this JSON file")
+    parser.add_argument("--csv", help="write results to this CSV file")
+    args = parser.parse_args()
+
+    unknown = [a for a in args.algorithms if a not in ALGORITHMS]
+    if unknown:
+        parser.error(f"unknown algorithm(s): {', '.join(unknown)}")
+
+    rows = sweep(args.sizes, args.s_size, args.mem_blocks, args.tuples_per_block, args.skew,
+                 args.algorithms, args.repeat, args.seed, not args.no_heap)
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.csv:
+        write_csv(rows, args.csv)
+
+if __name__ == "__main__":
+    main()
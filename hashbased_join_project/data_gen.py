@@ -1,12 +1,13 @@
 import random
+from itertools import accumulate
 from disk import Block, VirtualDisk
 
 rng = random.Random(42)
 
-def build_relation_S() -> VirtualDisk:
-    """Builds relation S(B, C) with 5000 tuples. B is unique integer, C is random value"""
-    disk = VirtualDisk()
-    for b in rng.sample(range(10_000, 50_001), 5_000):
+def build_relation_S(size: int = 5_000) -> VirtualDisk:
+    """Builds relation S(B, C) with given size (5000 tuples by default). B is unique integer, C is random value"""
+    disk = VirtualDisk("S")
+    for b in rng.sample(range(10_000, 50_001), size):
         # Use the last block if it's not full: else start a new one
         blk = Block() if (len(disk) == 0 or disk.blocks[-1].is_full()) else disk.blocks[-1]
         tup = (b, rng.randint(0, 999_999))  #(B, C)
@@ -16,18 +17,25 @@ def build_relation_S() -> VirtualDisk:
     return disk
 
 def build_relation_R(size: int, S_disk: VirtualDisk,
-                     restrict_to_S_values=True) -> VirtualDisk:
+                     restrict_to_S_values=True, skew: float = 0.0) -> VirtualDisk:
     """Build relation R(A, B) with given size. 
         If restrict_to_S_values: B is sampled from S(B, C)
-        Else: B is a random integer in [20,000, 30,000] range """
+        Else: B is a random integer in [20,000, 30,000] range
+        skew = 0 picks B uniformly, skew > 0 picks it Zipf-like: the i-th value has weight 1 / i**skew"""
     if restrict_to_S_values:
         # Extract B-values from S to overlap
         S_B_vals = [t[0] for blk in S_disk.blocks for t in blk]
     else:
         S_B_vals = list(range(20_000, 30_001))
-    disk = VirtualDisk()
+    cum_weights = None
+    if skew > 0:
+        cum_weights = list(accumulate(1 / (i + 1) ** skew for i in range(len(S_B_vals))))
+    disk = VirtualDisk("R")
     for _ in range(size):
-        b = rng.choice(S_B_vals)
+        if cum_weights is None:
+            b = rng.choice(S_B_vals)
+        else:
+            b = rng.choices(S_B_vals, cum_weights=cum_weights)[0]
         a = rng.randint(0, 999_999)
         blk = Block() if (len(disk) == 0 or disk.blocks[-1].is_full()) else disk.blocks[-1]
         blk.add((a, b))
@@ -35,6 +43,20 @@ def build_relation_R(size: int, S_disk: VirtualDisk,
             disk.write_block(blk)
     return disk
 
+def build_relation_T(size: int, S_disk: VirtualDisk) -> VirtualDisk:
+    """Build relation T(C, D) with given size, used for three-way joins.
+        C is sampled from the C values of S(B, C), D is a random value"""
+    S_C_vals = [t[1] for blk in S_disk.blocks for t in blk]
+    disk = VirtualDisk("T")
+    for _ in range(size):
+        c = rng.choice(S_C_vals)
+        d = rng.randint(0, 999_999)
+        blk = Block() if (len(disk) == 0 or disk.blocks[-1].is_full()) else disk.blocks[-1]
+        blk.add((c, d))
+        if blk not in disk.blocks:
+            disk.write_block(blk)
+    return disk
+
 if __name__ == "__main__":
     # Generate base, test relations
     S = build_relation_S()
@@ -1,3 +1,14 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # shared profiler.py lives in the repository root
+from profiler import Profiler
+
+
 class Block:
     MAX_TUPLES = 8  # each block can hold 8 tuples 
 
@@ -20,13 +31,20 @@ class Block:
 
 
 class VirtualDisk:
-    def __init__(self):
+    READ_LATENCY = 0.0  # seconds each block read takes (0 = instant), set it to act like a real device
+    _device = threading.Lock()  # all disks share one simulated device: one read at a time
+
+    def __init__(self, name: str = ""):
         self.blocks: list[Block] = [] # "Unlimited disk storage"
+        self.name = name or f"disk@{id(self):x}"  # shows up in profiler timelines
 
     def write_block(self, blk: Block):
         self.blocks.append(blk)  # write a block to the disk
 
     def read_block(self, idx: int) -> Block:
+        if VirtualDisk.READ_LATENCY:
+            with VirtualDisk._device:
+                time.sleep(VirtualDisk.READ_LATENCY)
         return self.blocks[idx] # read a block by index
 
     def __len__(self):
@@ -35,21 +53,147 @@ class VirtualDisk:
 
 class VirtualMemory:
     MAX_BLOCKS = 15  # memory can hold up to 15 blocks at once
-    def __init__(self):
+    def __init__(self, profiler: Optional[Profiler] = None):
         self.blocks: list[Block] = [] # buffer in main memory
         self.io_counter = 0    # count IO operatoins
+        self.reserved = 0      # slots held outside self.blocks: blocks being prefetched, hash/group tables
+        self.phase = None      # operator phase the IOs are charged to (see enter_phase)
+        self.phase_io = defaultdict(int)  # "<phase>.read" / "<phase>.write" -> number of IOs
+        self.peak_blocks = 0   # most slots ever in use at once: buffered blocks + reserved (read-ahead, tables, output buffers)
+        self.profiler = profiler  # optional, gets every phase change and block IO
+
+    # Charge the following IOs to a named phase, e.g. "partition", "build" or "probe"
+    def enter_phase(self, name: str):
+        self.phase = name
+        if self.profiler is not None:
+            self.profiler.enter_phase(name)
+
+    def pull(self, stream):
+        """Iterates over the output of a child operator (e.g. a *_join_stream feeding an aggregate).
+            The child's phase and open profiler spans are only current while it makes its next
+            tuple, so what the caller does with the tuple (e.g. spill writes) is charged to the
+            caller's phase and span instead of whatever phase the paused child was in"""
+        it = iter(stream)
+        prof = self.profiler
+        child_phase, child_spans = None, []
+        try:
+            while True:
+                my_phase = self.phase
+                depth = prof.depth if prof is not None else 0
+                if child_phase is not None:
+                    self.phase = child_phase
+                if prof is not None:
+                    prof.resume(child_spans)
+                child_spans = []
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    child_phase = self.phase
+                    if prof is not None:
+                        child_spans = prof.suspend(depth)
+                    self.phase = my_phase
+                yield item
+        finally:
+            # stopped early: let the child close its spans where they belong
+            if prof is not None:
+                prof.resume(child_spans)
+            if hasattr(it, "close"):
+                it.close()
+
+    def _count_io(self, kind: str, disk: VirtualDisk, blk_idx: int, **args):
+        self.io_counter += 1
+        if self.phase is not None:
+            self.phase_io[f"{self.phase}.{kind}"] += 1
+        if self.profiler is not None:
+            self.profiler.block_io(kind, disk.name, blk_idx, **args)
+
+    def _track_peak(self):
+        used = len(self.blocks) + self.reserved
+        if used > self.peak_blocks:
+            self.peak_blocks = used
 
+    # Slots not taken by a buffered block or a reservation
+    def free_slots(self) -> int:
+        return VirtualMemory.MAX_BLOCKS - len(self.blocks) - self.reserved
+
+    def reserve(self, n: int):
+        """Holds n memory slots for something that isn't a disk block (e.g. an operator's hash table),
+            so reads and read-ahead can't use them. Give them back with release(n)"""
+        if n > self.free_slots():
+            raise RuntimeError("Main memory full")
+        self.reserved += n
+        self._track_peak()
+
+    def release(self, n: int):
+        self.reserved -= n
 
     def read(self, disk: VirtualDisk, blk_idx: int):
-        if len(self.blocks) >= VirtualMemory.MAX_BLOCKS:
+        if self.free_slots() <= 0:
             raise RuntimeError("Main memory full")
         # simulate disk to memory read
         self.blocks.append(disk.read_block(blk_idx))
-        self.io_counter += 1
+        self._count_io("read", disk, blk_idx)
+        self._track_peak()
 
     def write(self, disk: VirtualDisk, blk: Block):
         # simulate memory to disk write
         disk.write_block(blk)
-        self.io_counter += 1
+        self._count_io("write", disk, len(disk) - 1)
         if blk in self.blocks:  
             self.blocks.remove(blk)  # clear the slot from memory
+
+    def scan(self, disk: VirtualDisk, prefetch: int = 0):
+        """Yields the blocks of disk in order. Each block sits in memory (self.blocks[-1])
+            while the caller works on it and is removed when the caller asks for the next one.
+            With prefetch = N, up to N of the next blocks are queued on a background reader thread
+            and land in reserved memory slots, so reading overlaps with whatever the caller does
+            with the current block (the reads themselves still go one at a time, like one disk).
+            The read-ahead only gets the slots that are free besides the one for the current block"""
+        depth = min(prefetch, len(disk), self.free_slots() - 1)
+        if depth <= 0:
+            for blk_idx in range(len(disk)):
+                self.read(disk, blk_idx)
+                blk = self.blocks[-1]
+                try:
+                    yield blk
+                finally:
+                    self._drop(blk)
+            return
+
+        self.reserve(depth)
+
+        pool = ThreadPoolExecutor(max_workers=1)
+        pending = deque()   # (block index, read) in flight, in block order
+        next_idx = 0
+        try:
+            while next_idx < depth:
+                pending.append((next_idx, pool.submit(disk.read_block, next_idx)))
+                next_idx += 1
+
+            while pending:
+                blk_idx, fut = pending.popleft()
+                blk = fut.result()
+                # counted once the block is handed over, reads cancelled by an early close never count
+                self._count_io("read", disk, blk_idx, prefetch=True)
+                self.blocks.append(blk)  # move it from its reserved slot to the working slot
+                self._track_peak()
+                # the freed slot goes straight to the next read
+                if next_idx < len(disk):
+                    pending.append((next_idx, pool.submit(disk.read_block, next_idx)))
+                    next_idx += 1
+                try:
+                    yield blk
+                finally:
+                    self._drop(blk)
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+            pool.shutdown(wait=True)
+            self.release(depth)
+
+    # remove a processed block from memory, unless the caller already cleared it
+    def _drop(self, blk: Block):
+        if self.blocks and self.blocks[-1] is blk:
+            self.blocks.pop()
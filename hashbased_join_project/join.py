@@ -1,148 +1,304 @@
 from collections import defaultdict
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Sequence, Tuple
 from disk import Block, VirtualDisk, VirtualMemory
+from profiler import Profiler, span
 
-# Hash function using modulo division
-def h(val: int, buckets: int = 101) -> int:
+# A schema is a tuple of attribute names, e.g. ("A", "B"), and join keys are tuples of column
+# indices into it, e.g. (1,) for B. The joined schema is the left schema followed by the right
+# schema minus its key columns, so R(A, B) join S(B, C) on B gives (A, B, C).
+Schema = Tuple[str, ...]
+Keys = Tuple[int, ...]
+
+R_SCHEMA: Schema = ("A", "B")
+S_SCHEMA: Schema = ("B", "C")
+
+_MASK64 = (1 << 64) - 1
+
+# Hash function using modulo division (composite keys are hashed down to an int first).
+# Repartitioning levels > 0 scramble the value first (splitmix64 seeded with the level), so a
+# partition that got too big is split independently of the hash that built it
+def h(val, buckets: int = 101, level: int = 0) -> int:
+    if not isinstance(val, int):
+        val = hash(val)
+    if level:
+        val = (val + level * 0x9E3779B97F4A7C15) & _MASK64
+        val = ((val ^ (val >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        val = ((val ^ (val >> 27)) * 0x94D049BB133111EB) & _MASK64
+        val ^= val >> 31
     return val % buckets
 
-# One pass hash join between R(A, B) and S(B, C)
-def one_pass_hash_join(R_disk: VirtualDisk, S_disk: VirtualDisk) -> Tuple[List[Tuple[int, int, int]], int]:
-    """Performs one pass natural join between R and S on attribute B. 
-        Assumes smaller relation fits entirely in memory (<= 15 blocks)
+# Value of the join key in a tuple: a single column is returned as is, a composite key as a tuple
+def join_key(tup: tuple, cols: Keys):
+    if len(cols) == 1:
+        return tup[cols[0]]
+    return tuple(tup[c] for c in cols)
+
+def join_schema(left_schema: Schema, right_schema: Schema, right_keys: Keys) -> Schema:
+    """Schema of left join right: all left attributes, then the right ones that aren't join keys"""
+    return tuple(left_schema) + tuple(a for i, a in enumerate(right_schema) if i not in right_keys)
+
+def _check_keys(left_schema: Schema, right_schema: Schema, left_keys: Keys, right_keys: Keys):
+    if len(left_keys) == 0 or len(left_keys) != len(right_keys):
+        raise ValueError("Join needs the same (non-zero) number of key columns on both sides")
+    for schema, keys in ((left_schema, left_keys), (right_schema, right_keys)):
+        for c in keys:
+            if not 0 <= c < len(schema):
+                raise ValueError(f"Key column {c} is out of range for schema {schema}")
+
+# columns of the right tuple that end up in the output
+def _kept_cols(right_schema: Schema, right_keys: Keys) -> Tuple[int, ...]:
+    return tuple(i for i in range(len(right_schema)) if i not in right_keys)
+
+# Append a tuple to the last block of a disk, starting a new block (and paying one write) when it's full
+def append_tuple(vm: VirtualMemory, disk: VirtualDisk, tup: tuple):
+    dst_blk = (disk.blocks[-1]
+               if disk.blocks and not disk.blocks[-1].is_full()
+               else Block())
+    dst_blk.add(tup)
+    if dst_blk not in disk.blocks:
+        vm.write(disk, dst_blk)  # write block to disk and remove from memory
+
+# Hash every tuple of src into one of the partition disks based on its join key (with a different
+# hash on every repartitioning level). Each partition's output buffer holds a memory slot,
+# read-ahead only gets what's left after them
+def partition_relation(src: VirtualDisk, vm: VirtualMemory, parts: List[VirtualDisk], key_cols: Keys,
+                       prefetch: int = 0, level: int = 0):
+    vm.reserve(len(parts))
+    try:
+        for blk in vm.scan(src, prefetch):   # processed input block is removed from memory by the scan
+            for tup in blk:
+                append_tuple(vm, parts[h(join_key(tup, key_cols), len(parts), level)], tup)
+    finally:
+        vm.release(len(parts))
+
+# Probe a hash table (join key -> build tuples) with every tuple of a block and yield the joined tuples.
+# Output is always left + kept right columns, no matter which side the table was built on
+def _probe_block(blk: Block, hash_t, probe_keys: Keys, build_is_left: bool, keep: Tuple[int, ...]):
+    for tup in blk:
+        for match in hash_t.get(join_key(tup, probe_keys), ()):
+            if build_is_left:
+                yield match + tuple(tup[i] for i in keep)
+            else:
+                yield tup + tuple(match[i] for i in keep)
+
+# One pass hash join between L and R on any key columns
+def one_pass_join_stream(L_disk: VirtualDisk, R_disk: VirtualDisk,
+                         L_schema: Schema, R_schema: Schema, L_keys: Keys, R_keys: Keys,
+                         mem: VirtualMemory, prefetch: int = 0) -> Iterator[tuple]:
+    """Joins L and R where L[L_keys] == R[R_keys], yielding tuples of join_schema(L_schema, R_schema, R_keys)
+        one at a time. Assumes the smaller relation fits entirely in memory. Disk IOs are counted on mem"""
+    with span(mem.profiler, "one_pass_join"):
+        _check_keys(L_schema, R_schema, L_keys, R_keys)
+        keep = _kept_cols(R_schema, R_keys)
+
+        # Choose smaller relation to build the hash table on
+        if len(L_disk) <= len(R_disk):
+            small_disk, large_disk, build_keys, probe_keys, build_is_left = L_disk, R_disk, L_keys, R_keys, True
+        else:
+            small_disk, large_disk, build_keys, probe_keys, build_is_left = R_disk, L_disk, R_keys, L_keys, False
+
+        # Read the small relation into memory and build hash table
+        mem.enter_phase("build")
+        hash_table = defaultdict(list) # maps the join key to a list of tuples
+        for blk_idx in range(len(small_disk)):
+            mem.read(small_disk, blk_idx)
+        for blk in mem.blocks:
+            for tup in blk:
+                hash_table[join_key(tup, build_keys)].append(tup)
+
+        # Scan the large relation and probe hash table
+        mem.enter_phase("probe")
+        for blk in mem.scan(large_disk, prefetch):   # load one block, cleared after processing
+            yield from _probe_block(blk, hash_table, probe_keys, build_is_left, keep)
+
+        mem.blocks.clear()  # drop the build side so the next operator gets the memory back
+
+def one_pass_join(L_disk: VirtualDisk, R_disk: VirtualDisk,
+                  L_schema: Schema, R_schema: Schema, L_keys: Keys, R_keys: Keys,
+                  prefetch: int = 0, profiler: Optional[Profiler] = None) -> Tuple[List[tuple], int]:
+    """One pass hash join of L and R on L[L_keys] == R[R_keys].
         Returns the resulting tuples and the number of disk IOs used"""
-    
-    # Choose smaller relation to build the hash table on
-    if len(R_disk) <= len(S_disk):
-        small_disk, large_disk = R_disk, S_disk
-        build_side = 'R'
-    else:
-        small_disk, large_disk = S_disk, R_disk
-        build_side = 'S'
+    mem = VirtualMemory(profiler)  # Resets IO counter
+    result = list(one_pass_join_stream(L_disk, R_disk, L_schema, R_schema, L_keys, R_keys, mem, prefetch))
+    return result, mem.io_counter
 
-    mem = VirtualMemory()  # Resets IO counter
+def two_pass_join_stream(L_disk: VirtualDisk, R_disk: VirtualDisk,
+                         L_schema: Schema, R_schema: Schema, L_keys: Keys, R_keys: Keys,
+                         vm: VirtualMemory, mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                         prefetch: int = 0) -> Iterator[tuple]:
+    """Two pass hash join of L and R on L[L_keys] == R[R_keys], yielding tuples of
+        join_schema(L_schema, R_schema, R_keys) one at a time. Disk IOs are counted on vm"""
+    with span(vm.profiler, "two_pass_join"):
+        _check_keys(L_schema, R_schema, L_keys, R_keys)
+        keep = _kept_cols(R_schema, R_keys)
 
-    # Read the small relation into memory and build hash table
-    hash_table = defaultdict(list) # maps B to a list of tuples
-    for blk_idx in range(len(small_disk)):
-        mem.read(small_disk, blk_idx)
-    for blk in mem.blocks:
-        for tup in blk:
-            if build_side == 'R':   # tuple is (A, B)
-                a, b = tup
-                hash_table[h(b)].append(tup)
-            else:   # tuple is (B, C)
-                b, c = tup
-                hash_table[h(b)].append(tup)
-
-    # Scan the large relation and probe hash table
-    result = []
-    for blk_idx in range(len(large_disk)):
-        mem.read(large_disk, blk_idx)   # load one block
-        blk = mem.blocks[-1]
+        # Pass 1: partition phase
+        # (the partition scans only read ahead into slots the output buffers leave free)
+        num_partitions = min(mem_blocks, vm.free_slots()) - 1   # Leave oe block for input buffering
+        L_parts = [VirtualDisk(f"L_part{pid}") for pid in range(num_partitions)]
+        R_parts = [VirtualDisk(f"R_part{pid}") for pid in range(num_partitions)]
+
+        # hash each tuple of both relations on its join key into one of that relation's partitions
+        vm.enter_phase("partition")
+        partition_relation(L_disk, vm, L_parts, L_keys, prefetch)
+        partition_relation(R_disk, vm, R_parts, R_keys, prefetch)
+
+        # Pass 2: probe each partition pair
+        for pid in range(num_partitions):
+            yield from _join_partition_pair(L_parts[pid], R_parts[pid], L_keys, R_keys, keep,
+                                            vm, mem_blocks, prefetch)
+
+MAX_LEVELS = 4  # times a partition pair gets split again before we give up on it
+
+def _join_partition_pair(Lp: VirtualDisk, Rp: VirtualDisk, L_keys: Keys, R_keys: Keys, keep: Tuple[int, ...],
+                         vm: VirtualMemory, mem_blocks: int, prefetch: int, level: int = 0) -> Iterator[tuple]:
+    """Joins one pair of partitions with a hash table on the smaller side. The build side has to fit in
+        the memory that is free right now (other operators, like an aggregate fed by this join, may
+        hold some of it). If neither side fits, both are split again with a new hash and each
+        sub-pair is joined the same way"""
+    if len(Lp) == 0 or len(Rp) == 0:
+        return   # Nothing to join
+
+    # decide which partition is small enough to build a hash table on (one block is left for the probe scan)
+    budget = min(mem_blocks, vm.free_slots())
+    if len(Lp) <= len(Rp) and len(Lp) < budget:
+        small, large, build_keys, probe_keys, build_is_left = Lp, Rp, L_keys, R_keys, True
+    elif len(Rp) < budget:
+        small, large, build_keys, probe_keys, build_is_left = Rp, Lp, R_keys, L_keys, False
+    else:
+        # too large: split both sides again, one output buffer per sub-partition plus the input block
+        num_partitions = budget - 1
+        if level >= MAX_LEVELS or num_partitions < 2:
+            raise RuntimeError("Partition still too large for one-pass")
+        L_sub = [VirtualDisk(f"{Lp.name}.{pid}") for pid in range(num_partitions)]
+        R_sub = [VirtualDisk(f"{Rp.name}.{pid}") for pid in range(num_partitions)]
+        vm.enter_phase("partition")
+        partition_relation(Lp, vm, L_sub, L_keys, prefetch, level + 1)
+        partition_relation(Rp, vm, R_sub, R_keys, prefetch, level + 1)
+        for pid in range(num_partitions):
+            yield from _join_partition_pair(L_sub[pid], R_sub[pid], L_keys, R_keys, keep,
+                                            vm, mem_blocks, prefetch, level + 1)
+        return
+
+    # Read the smaller side into memory and build the hash table
+    vm.enter_phase("build")
+    first = len(vm.blocks)
+    hash_t = defaultdict(list)
+    for blk_idx in range(len(small)):
+        vm.read(small, blk_idx)
+    for blk in vm.blocks[first:]:
         for tup in blk:
-            if build_side == 'R': # tuple is (B, C)
-                b, c = tup
-                for (a_build, b_build) in hash_table[h(b)]:
-                    if b_build == b:
-                        result.append((a_build, b, c))
-            else: # tuple is (A, B)
-                a, b = tup
-                for (b_build, c_build) in hash_table[h(b)]:
-                    if b_build == b:
-                        result.append((a, b, c_build))
-        mem.blocks.pop()  # clear one block from memory after processing
+            hash_t[join_key(tup, build_keys)].append(tup)
+
+    # scan larger side and probe the hash table
+    vm.enter_phase("probe")
+    for blk in vm.scan(large, prefetch):   # block is removed after processing
+        yield from _probe_block(blk, hash_t, probe_keys, build_is_left, keep)
+
+    del vm.blocks[first:]  # clear memory before next partition
+
+def two_pass_join(L_disk: VirtualDisk, R_disk: VirtualDisk,
+                  L_schema: Schema, R_schema: Schema, L_keys: Keys, R_keys: Keys,
+                  mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                  prefetch: int = 0, profiler: Optional[Profiler] = None) -> Tuple[List[tuple], int]:
+    """Two pass hash join of L and R on L[L_keys] == R[R_keys].
+        Returns (joined tuples, total disk/IOs)"""
+    vm = VirtualMemory(profiler)  # Will reuse this across both passes
+    result = list(two_pass_join_stream(L_disk, R_disk, L_schema, R_schema, L_keys, R_keys,
+                                       vm, mem_blocks, prefetch))
+    return result, vm.io_counter
 
+def pipelined_schema(probe_schema: Schema, builds: Sequence[tuple]) -> Schema:
+    """Output schema of pipelined_hash_join_stream for the same probe_schema and builds"""
+    schema = tuple(probe_schema)
+    for _, build_schema, _, build_keys in builds:
+        schema = join_schema(schema, build_schema, build_keys)
+    return schema
+
+def pipelined_hash_join_stream(probe_disk: VirtualDisk, probe_schema: Schema, builds: Sequence[tuple],
+                               mem: VirtualMemory, prefetch: int = 0) -> Iterator[tuple]:
+    """
+    Multi-way hash join, e.g. R join S join T, without writing any intermediate result out.
+    builds is a list of (disk, schema, probe_keys, build_keys), one per relation to join with, in order.
+    probe_keys index into the schema built up so far (the probe relation joined with every earlier
+    build relation), build_keys index into that build relation's own schema.
+
+    Every build relation is read into memory once and its hash table stays resident; the probe
+    relation is scanned one block at a time and each tuple flows through the tables in turn.
+    All build relations together must fit in memory, leaving one block for the probe scan.
+    Yields tuples of pipelined_schema(probe_schema, builds). Disk IOs are counted on mem.
+    """
+    with span(mem.profiler, "pipelined_hash_join"):
+        # Build every hash table up front, checking each join against the schema it will see
+        mem.enter_phase("build")
+        stages = []
+        schema = tuple(probe_schema)
+        for build_disk, build_schema, probe_keys, build_keys in builds:
+            _check_keys(schema, build_schema, probe_keys, build_keys)
+            first = len(mem.blocks)
+            for blk_idx in range(len(build_disk)):
+                mem.read(build_disk, blk_idx)   # raises once the build relations don't fit
+            hash_t = defaultdict(list)
+            for blk in mem.blocks[first:]:
+                for tup in blk:
+                    hash_t[join_key(tup, build_keys)].append(tup)
+            stages.append((hash_t, probe_keys, _kept_cols(build_schema, build_keys)))
+            schema = join_schema(schema, build_schema, build_keys)
+
+        # Stream the probe relation through the resident tables
+        mem.enter_phase("probe")
+        for blk in mem.scan(probe_disk, prefetch):
+            for tup in blk:
+                partial = [tup]
+                for hash_t, probe_keys, keep in stages:
+                    partial = [t + tuple(m[i] for i in keep)
+                               for t in partial
+                               for m in hash_t.get(join_key(t, probe_keys), ())]
+                    if not partial:
+                        break   # no match at this stage, nothing left to pass on
+                yield from partial
+
+        mem.blocks.clear()  # release the build tables
+
+def pipelined_hash_join(probe_disk: VirtualDisk, probe_schema: Schema, builds: Sequence[tuple],
+                        prefetch: int = 0, profiler: Optional[Profiler] = None) -> Tuple[List[tuple], int]:
+    """Multi-way pipelined hash join, see pipelined_hash_join_stream.
+        Returns (joined tuples, total disk IOs)"""
+    mem = VirtualMemory(profiler)
+    result = list(pipelined_hash_join_stream(probe_disk, probe_schema, builds, mem, prefetch))
     return result, mem.io_counter
 
-def two_pass_hash_join(R_disk: VirtualDisk, S_disk: VirtualDisk, 
-                       mem_blocks: int = VirtualMemory.MAX_BLOCKS) -> Tuple[List[Tuple[int, int, int]], int]:
+# One pass hash join between R(A, B) and S(B, C)
+def one_pass_hash_join_stream(R_disk: VirtualDisk, S_disk: VirtualDisk, mem: VirtualMemory,
+                              prefetch: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """Same as one_pass_hash_join, but yields the joined tuples one at a time
+        so they can be fed straight into another operator. Disk IOs are counted on mem"""
+    return one_pass_join_stream(R_disk, S_disk, R_SCHEMA, S_SCHEMA, (1,), (0,), mem, prefetch)
+
+def one_pass_hash_join(R_disk: VirtualDisk, S_disk: VirtualDisk,
+                       prefetch: int = 0,
+                       profiler: Optional[Profiler] = None) -> Tuple[List[Tuple[int, int, int]], int]:
+    """Performs one pass natural join between R and S on attribute B.
+        Assumes smaller relation fits entirely in memory (<= 15 blocks, minus prefetch slots)
+        prefetch = N reads N blocks of the larger relation ahead while probing
+        Returns the resulting tuples and the number of disk IOs used"""
+    return one_pass_join(R_disk, S_disk, R_SCHEMA, S_SCHEMA, (1,), (0,), prefetch, profiler)
+
+def two_pass_hash_join_stream(R_disk: VirtualDisk, S_disk: VirtualDisk, vm: VirtualMemory,
+                              mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                              prefetch: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """Same as two_pass_hash_join, but yields the joined tuples one at a time
+        so they can be fed straight into another operator. Disk IOs are counted on vm"""
+    return two_pass_join_stream(R_disk, S_disk, R_SCHEMA, S_SCHEMA, (1,), (0,), vm, mem_blocks, prefetch)
+
+def two_pass_hash_join(R_disk: VirtualDisk, S_disk: VirtualDisk,
+                       mem_blocks: int = VirtualMemory.MAX_BLOCKS,
+                       prefetch: int = 0,
+                       profiler: Optional[Profiler] = None) -> Tuple[List[Tuple[int, int, int]], int]:
     """
     Performs two pass hash join on relations R(A, B) and S(B, C) using B as the join key.
+    prefetch = N reads up to N blocks ahead during the scans, as far as free memory allows
+    (partitioning uses all but one block for output buffers, so mostly the probe scans)
     Returns (joined tuples, total disk/IOs)
     """
-    # Pass 1: partition phase 
-    num_partitions = mem_blocks - 1   # Leave oe block for input buffering
-    R_parts = [VirtualDisk() for _ in range(num_partitions)]
-    S_parts = [VirtualDisk() for _ in range(num_partitions)]
-
-    vm = VirtualMemory()  # Will reuse this across both relations
-
-    # partition R: hash each (A, B) tuple based on B into one of the R partitions
-    for blk_idx in range(len(R_disk)):
-        vm.read(R_disk, blk_idx)
-        blk = vm.blocks[-1]
-        for (a, b) in blk:
-            pid = h(b, num_partitions)
-            dst_blk = (R_parts[pid].blocks[-1]
-                       if R_parts[pid].blocks and not R_parts[pid].blocks[-1].is_full()
-                       else Block())
-            dst_blk.add((a, b))
-            if dst_blk not in R_parts[pid].blocks:
-                vm.write(R_parts[pid], dst_blk)  # write block to disk and remove from memory
-        vm.blocks.pop()   # remove processed input block from memory
-
-    # partition S: hash each (B, C) tuple based on B into one of the S partitions
-    for blk_idx in range(len(S_disk)):
-        vm.read(S_disk, blk_idx)
-        blk = vm.blocks[-1]
-        for (b, c) in blk:
-            pid = h(b, num_partitions)
-            dst_blk = (S_parts[pid].blocks[-1]
-                       if S_parts[pid].blocks and not S_parts[pid].blocks[-1].is_full()
-                       else Block())
-            dst_blk.add((b, c))
-            if dst_blk not in S_parts[pid].blocks:
-                vm.write(S_parts[pid], dst_blk)
-        vm.blocks.pop()
-
-    pass1_io = vm.io_counter  # Save number of IOs so far
-    vm = VirtualMemory()   #Reset memory and IO counter for next pass
-
-    # Pass 2: probe each partition pair 
-    result = []
-    for pid in range(num_partitions):
-        Rp, Sp = R_parts[pid], S_parts[pid]
-        if len(Rp) == 0 or len(Sp) == 0:
-            continue   # Nothing to join
-
-        # decide which partition is small enough to build a hash table on
-        if len(Rp) <= len(Sp) and len(Rp) <= mem_blocks:
-            small, large, build_R = Rp, Sp, True
-        elif len(Sp) <= mem_blocks:
-            small, large, build_R = Sp, Rp, False
-        else:
-            raise RuntimeError("Partition still too large for one-pass")
-
-        # Read the smaller side into memory and build the hash table
-        hash_t = defaultdict(list)
-        for blk_idx in range(len(small)):
-            vm.read(small, blk_idx)
-        for blk in vm.blocks:
-            for tup in blk:
-                if build_R:
-                    a, b = tup
-                    hash_t[b].append(a) # map B to all matching A's
-                else:
-                    b, c = tup
-                    hash_t[b].append(c) # mab B to all matching C's
-
-        # scan larger side and probe the hash table
-        for blk_idx in range(len(large)):
-            vm.read(large, blk_idx)
-            blk = vm.blocks[-1]
-            for tup in blk:
-                if build_R:
-                    b, c = tup
-                    for a in hash_t.get(b, []):
-                        result.append((a, b, c))
-                else:
-                    a, b = tup
-                    for c in hash_t.get(b, []):
-                        result.append((a, b, c))
-            vm.blocks.pop()  # remove block after processing
-
-        vm.blocks.clear()  # clear memory before next partition
-
-    total_io = pass1_io + vm.io_counter
-    return result, total_io
\ No newline at end of file
+    return two_pass_join(R_disk, S_disk, R_SCHEMA, S_SCHEMA, (1,), (0,), mem_blocks, prefetch, profiler)
@@ -1,6 +1,13 @@
-from data_gen import build_relation_S, build_relation_R
+from collections import defaultdict
+import data_gen
+from data_gen import build_relation_S, build_relation_R, build_relation_T
 from join import one_pass_hash_join
 from join import two_pass_hash_join
+from join import two_pass_hash_join_stream
+from join import two_pass_join, pipelined_hash_join, pipelined_schema
+from aggregate import one_pass_hash_aggregate, two_pass_hash_aggregate, hash_aggregate_stream
+from disk import VirtualMemory
+from profiler import Profiler
 
 # one hash join test
 '''
@@ -22,4 +29,93 @@ print("blocks   S:", len(S), "  Rlarge:", len(Rlarge))
 
 out, ios = two_pass_hash_join(Rlarge, S)
 print("joined tuples:", len(out), "   disk I/Os:", ios)
-'''
\ No newline at end of file
+'''
+
+'''
+# hash aggregation test
+print("Hash aggregation:")
+S = build_relation_S()
+Rlarge = build_relation_R(1000, S, True)
+print("blocks   Rlarge:", len(Rlarge))
+
+# COUNT of R grouped by B (too many groups for one pass, so partitions get spilled)
+groups, ios = two_pass_hash_aggregate(Rlarge, 1, 0, "COUNT")
+print("groups:", len(groups), "   disk I/Os:", ios)
+groups, ios = two_pass_hash_aggregate(Rlarge, 1, 0, "COUNT", pre_aggregate=False)
+print("groups:", len(groups), "   disk I/Os without pre-aggregation:", ios)
+
+# SUM of C grouped by B over R join S, without writing the join result out
+# (the aggregate gets 5 of the 15 memory blocks, the join sizes its hash tables to the rest)
+vm = VirtualMemory()
+groups = hash_aggregate_stream(two_pass_hash_join_stream(Rlarge, S, vm), 1, 2, "SUM", vm, mem_blocks=5)
+print("groups:", len(groups), "   disk I/Os (join + aggregate):", vm.io_counter)
+'''
+
+'''
+# general join test: same R join S, but described by schemas and key columns
+print("Two pass join with schemas:")
+S = build_relation_S()
+Rlarge = build_relation_R(1200, S, False)
+out, ios = two_pass_join(Rlarge, S, ("A", "B"), ("B", "C"), (1,), (0,))
+print("joined tuples:", len(out), "   disk I/Os:", ios)
+'''
+
+'''
+# three-way pipelined join test: R join S join T, S and T stay in memory
+print("Pipelined three-way join:")
+S_small = build_relation_S(40)               # 40 tuples / 5 blocks
+T = build_relation_T(40, S_small)            # 40 tuples / 5 blocks
+Rlarge = build_relation_R(1200, S_small, True)
+builds = [(S_small, ("B", "C"), (1,), (0,)), # R.B = S.B
+          (T, ("C", "D"), (2,), (0,))]       # (R join S).C = T.C
+out, ios = pipelined_hash_join(Rlarge, ("A", "B"), builds)
+print("schema:", pipelined_schema(("A", "B"), builds))
+print("joined tuples:", len(out), "   disk I/Os:", ios)
+'''
+
+'''
+# profiling test: time and I/Os per phase, plus a block-level timeline for chrome://tracing
+print("Profiled two pass hash join:")
+S = build_relation_S()
+Rlarge = build_relation_R(1000, S, True)
+prof = Profiler(timeline=True)
+out, ios = two_pass_hash_join(Rlarge, S, profiler=prof)
+print(prof.report())
+prof.export_chrome_trace("join_trace.json")
+'''
+
+'''
+# profiled join + aggregate pipeline: the aggregate's spill writes show up under hash_aggregate/aggregate
+# (and as aggregate.write), not under the join phase that was paused when they were written
+print("Profiled join + aggregate:")
+S = build_relation_S()
+Rlarge = build_relation_R(1000, S, True)
+prof = Profiler()
+vm = VirtualMemory(prof)
+groups = hash_aggregate_stream(two_pass_hash_join_stream(Rlarge, S, vm), 1, 2, "SUM", vm, mem_blocks=5)
+print(prof.report())
+print("I/Os per phase:", dict(vm.phase_io))
+print("writes charged to the join's probe phase:", vm.phase_io.get("probe.write", 0))   # should be 0
+'''
+
+'''
+# join + aggregate check: SUM of C grouped by B over R join S against the same SUM computed straight
+# from the blocks, for several data sets and aggregate memory budgets (None = the default half)
+print("Join + aggregate over several seeds:")
+for seed in range(10):
+    data_gen.rng.seed(seed)
+    S = build_relation_S()
+    Rlarge = build_relation_R(1000, S, True)
+    c_of = {b: c for blk in S.blocks for b, c in blk}
+    expected = defaultdict(int)
+    for blk in Rlarge.blocks:
+        for a, b in blk:
+            if b in c_of:
+                expected[b] += c_of[b]
+    for mem_blocks in (3, 5, None):
+        vm = VirtualMemory()
+        groups = hash_aggregate_stream(two_pass_hash_join_stream(Rlarge, S, vm), 1, 2, "SUM", vm, mem_blocks)
+        assert sorted(groups) == sorted(expected.items()), (seed, mem_blocks)
+        assert vm.peak_blocks <= VirtualMemory.MAX_BLOCKS
+    print("seed", seed, "ok")
+'''
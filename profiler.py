@@ -0,0 +1,167 @@
+# Per-operator profiling shared by the disk/memory model, the join operators and BPlusTree.
+# Both projects import this one module: disk.py and bplustree.py put the repository root on sys.path.
+#
+#   prof = Profiler(timeline=True)
+#   vm = VirtualMemory(profiler=prof)
+#   out = list(two_pass_join_stream(..., vm))
+#   print(prof.report())
+#   prof.export_chrome_trace("trace.json")   # open in chrome://tracing or ui.perfetto.dev
+#
+# Everything that takes a profiler defaults to None, and then only pays an "is None" check.
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Optional
+
+_NO_SPAN = nullcontext()
+
+
+class _Span:
+    """One open operator or phase. Closing it adds its time to the profiler"""
+    def __init__(self, profiler: "Profiler", name: str, is_phase: bool):
+        self.profiler = profiler
+        self.name = name
+        self.is_phase = is_phase
+        self.path = None
+        self.start = 0.0       # start of the current stretch (spans can be suspended, see Profiler.suspend)
+        self.start_cpu = 0.0
+        self.elapsed = 0.0     # wall/CPU time of the stretches before it
+        self.elapsed_cpu = 0.0
+
+    def __enter__(self):
+        self.profiler._open(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._close(self)
+        return False
+
+
+class Profiler:
+    def __init__(self, timeline: bool = False):
+        self.counters = defaultdict(int)    # "<span path>.<name>" -> count
+        self.timers = defaultdict(float)    # span path -> total wall-clock seconds
+        self.cpu_timers = defaultdict(float)  # span path -> total CPU seconds (whole process)
+        self.calls = defaultdict(int)       # span path -> number of times it was entered
+        self.events = [] if timeline else None  # Chrome trace events, only kept with timeline=True
+        self._stack = []                    # open spans, innermost last
+        self._t0 = time.perf_counter()
+
+    # Path of the innermost open span, e.g. "two_pass_join/probe" ("" outside of any span)
+    @property
+    def current(self) -> str:
+        return self._stack[-1].path if self._stack else ""
+
+    # Number of open spans, to hand to suspend()
+    @property
+    def depth(self) -> int:
+        return len(self._stack)
+
+    def suspend(self, depth: int) -> list:
+        """Takes the spans opened after the stack was `depth` deep off the stack without closing them,
+            e.g. the spans of a child operator whose stream is paused between two tuples, and stops
+            their clocks. Returns them for resume()"""
+        spans = self._stack[depth:]
+        del self._stack[depth:]
+        now, now_cpu = time.perf_counter(), time.process_time()
+        for s in spans:
+            s.elapsed += now - s.start
+            s.elapsed_cpu += now_cpu - s.start_cpu
+            self._trace_span(s, now)
+        return spans
+
+    def resume(self, spans: list):
+        """Puts spans taken off by suspend() back on top of the stack and restarts their clocks"""
+        now, now_cpu = time.perf_counter(), time.process_time()
+        for s in spans:
+            s.start, s.start_cpu = now, now_cpu
+        self._stack.extend(spans)
+
+    def span(self, name: str) -> _Span:
+        """Context manager timing an operator (or any named piece of work) nested in the current span"""
+        return _Span(self, name, is_phase=False)
+
+    def enter_phase(self, name: str):
+        """Ends the current phase of the innermost operator (if any) and starts a new one.
+            Phases end on their own when the operator's span closes"""
+        if self._stack and self._stack[-1].is_phase:
+            self._close(self._stack[-1])
+        self._open(_Span(self, name, is_phase=True))
+
+    def count(self, name: str, n: int = 1):
+        path = self.current
+        self.counters[f"{path}.{name}" if path else name] += n
+
+    def block_io(self, kind: str, disk_name: str, blk_idx: int, **args):
+        """Counts one block read or write and, with timeline=True, records it with a timestamp"""
+        self.count(kind)
+        if self.events is not None:
+            self.events.append({
+                "name": kind, "cat": "io", "ph": "i", "s": "t",
+                "ts": self._now_us(), "pid": 1, "tid": threading.get_ident(),
+                "args": dict(disk=disk_name, block=blk_idx, span=self.current, **args),
+            })
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def _open(self, span: _Span):
+        parent = self.current
+        span.path = f"{parent}/{span.name}" if parent else span.name
+        span.start = time.perf_counter()
+        span.start_cpu = time.process_time()
+        self._stack.append(span)
+        self.calls[span.path] += 1
+
+    def _close(self, span: _Span):
+        if span not in self._stack:
+            return  # already closed, e.g. a phase that ended with its operator
+        # close anything still open inside this span (phases, abandoned streams) first
+        while self._stack:
+            top = self._stack.pop()
+            end = time.perf_counter()
+            self.timers[top.path] += top.elapsed + end - top.start
+            self.cpu_timers[top.path] += top.elapsed_cpu + time.process_time() - top.start_cpu
+            self._trace_span(top, end)
+            if top is span:
+                break
+
+    # timeline event for the stretch of a span that just ended (one per stretch if it was suspended)
+    def _trace_span(self, span: _Span, end: float):
+        if self.events is not None:
+            self.events.append({
+                "name": span.name, "cat": "phase" if span.is_phase else "operator", "ph": "X",
+                "ts": (span.start - self._t0) * 1e6, "dur": (end - span.start) * 1e6,
+                "pid": 1, "tid": threading.get_ident(), "args": {"path": span.path},
+            })
+
+    def report(self) -> str:
+        """Human readable summary: time and calls per span, then every counter"""
+        width = max([len(name) for name in list(self.timers) + list(self.counters)] + [20])
+        lines = [f"{'span':<{width}} {'calls':>6} {'time (ms)':>10} {'cpu (ms)':>10}"]
+        for path in sorted(self.timers):
+            lines.append(f"{path:<{width}} {self.calls[path]:>6} {self.timers[path] * 1000:>10.3f}"
+                         f" {self.cpu_timers[path] * 1000:>10.3f}")
+        lines.append("")
+        lines.append(f"{'counter':<{width}} {'value':>6}")
+        for name in sorted(self.counters):
+            lines.append(f"{name:<{width}} {self.counters[name]:>6}")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self) -> dict:
+        """Spans and (with timeline=True) block reads/writes in Chrome trace event format"""
+        return {"traceEvents": list(self.events or []), "displayTimeUnit": "ms",
+                "otherData": {"counters": dict(self.counters)}}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+# Shorthand for code that may or may not have a profiler: times `name` if there is one, no-op otherwise
+def span(profiler: Optional[Profiler], name: str):
+    if profiler is None:
+        return _NO_SPAN
+    return profiler.span(name)